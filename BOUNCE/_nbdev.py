@@ -2,7 +2,21 @@
 
 __all__ = ["index", "modules", "custom_doc_links", "git_url"]
 
-index = {"SDPEnvironment": "00_environment.ipynb",
+index = {"screened_solve": "00_environment.ipynb",
+         "claimed_solve": "00_environment.ipynb",
+         "completed": "00_environment.ipynb",
+         "then": "00_environment.ipynb",
+         "SDPEnvironment": "00_environment.ipynb",
+         "SQLiteMemory": "00_environment.ipynb",
+         "read_memory": "00_environment.ipynb",
+         "merge_memory": "00_environment.ipynb",
+         "read_journal": "00_environment.ipynb",
+         "append_journal": "00_environment.ipynb",
+         "compact_memory": "00_environment.ipynb",
+         "SharedMemory": "00_environment.ipynb",
+         "MemoryManager": "00_environment.ipynb",
+         "memory_manager": "00_environment.ipynb",
+         "VecSDPEnvironment": "00_environment.ipynb",
          "DQNAgent": "01_agents.ipynb",
          "DQN": "01_agents.ipynb",
          "BrFSAgent": "01_agents.ipynb",
@@ -19,6 +33,8 @@ index = {"SDPEnvironment": "00_environment.ipynb",
          "train_agent": "04_training.ipynb",
          "DQNTrainer.train": "04_training.ipynb",
          "step": "04_training.ipynb",
+         "submit_step": "04_training.ipynb",
+         "vec_step": "04_training.ipynb",
          "get_reward": "04_training.ipynb",
          "evaluate_agent": "04_training.ipynb",
          "check_optim": "04_training.ipynb",
@@ -40,6 +56,8 @@ index = {"SDPEnvironment": "00_environment.ipynb",
          "save_model": "05_utils.ipynb",
          "load_model": "05_utils.ipynb",
          "simplify_layout": "05_utils.ipynb",
+         "layout_key": "05_utils.ipynb",
+         "simplify_masks": "05_utils.ipynb",
          "fill_layout": "05_utils.ipynb",
          "state2int": "05_utils.ipynb",
          "state2str": "05_utils.ipynb",
@@ -52,9 +70,51 @@ index = {"SDPEnvironment": "00_environment.ipynb",
          "dist_poly": "05_utils.ipynb",
          "binomial": "05_utils.ipynb",
          "solve_sdp": "06_sdp.ipynb",
+         "SolveTimeout": "06_sdp.ipynb",
+         "run_limited": "06_sdp.ipynb",
+         "resolve_symmetries": "06_sdp.ipynb",
+         "PhaseTimer": "06_sdp.ipynb",
+         "cvxopt_stats": "06_sdp.ipynb",
+         "SolverStats": "06_sdp.ipynb",
+         "compile_layout": "06_sdp.ipynb",
+         "hamiltonian_terms": "06_sdp.ipynb",
          "complementary_system": "06_sdp.ipynb",
          "picos2np": "06_sdp.ipynb",
-         "ojimetro": "06_sdp.ipynb"}
+         "compatibility_pairs": "06_sdp.ipynb",
+         "normalization_roots": "06_sdp.ipynb",
+         "overlap": "06_sdp.ipynb",
+         "partial_trace_indices": "06_sdp.ipynb",
+         "partial_trace": "06_sdp.ipynb",
+         "embed_operator": "06_sdp.ipynb",
+         "hermitian_dual": "06_sdp.ipynb",
+         "SDPTemplate": "06_sdp.ipynb",
+         "ConicTemplate": "06_sdp.ipynb",
+         "translation_invariant": "06_sdp.ipynb",
+         "translation_representatives": "06_sdp.ipynb",
+         "expectation": "06_sdp.ipynb",
+         "pauli_key": "06_sdp.ipynb",
+         "local_paulis": "06_sdp.ipynb",
+         "pauli_matrix": "06_sdp.ipynb",
+         "lmi_coefficients": "06_sdp.ipynb",
+         "PAULIS": "06_sdp.ipynb",
+         "ADMMTemplate": "06_sdp.ipynb",
+         "project_rdms": "06_sdp.ipynb",
+         "simplex_projection": "06_sdp.ipynb",
+         "minimum_eigenvalues": "06_sdp.ipynb",
+         "pauli_basis": "06_sdp.ipynb",
+         "TEMPLATES": "06_sdp.ipynb",
+         "register_solver": "06_sdp.ipynb",
+         "route_layout": "06_sdp.ipynb",
+         "SOLVERS": "06_sdp.ipynb",
+         "ROUTES": "06_sdp.ipynb",
+         "cost_model": "06_sdp.ipynb",
+         "preflight": "06_sdp.ipynb",
+         "calibrate_preflight": "06_sdp.ipynb",
+         "PREFLIGHT": "06_sdp.ipynb",
+         "BENCHMARKS": "06_sdp.ipynb",
+         "ojimetro": "06_sdp.ipynb",
+         "key_parameters": "06_sdp.ipynb",
+         "free_parameters": "06_sdp.ipynb"}
 
 modules = ["environment.py",
            "agents.py",
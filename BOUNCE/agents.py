@@ -59,6 +59,18 @@ class DQNAgent:
                 Q[mask==False] = torch.min(Q) - 1. # Remove value from impossible actions
                 return torch.argsort(Q, descending=True)[:sum(mask)]
 
+    def try_actions_batch(self, states, masks=None):
+        """Ordered actions by priority for every state of a batch, as `try_actions`, with a single pass through the
+        model. The `masks` of possible actions can be provided, e.g., by `VecSDPEnvironment.action_masks`."""
+        if masks is None: masks = np.array([action_mask(state, self.N) for state in states])
+        with torch.no_grad():
+            Q = self.model(T(states).reshape(len(states), self.state_size).to(self.device)).cpu()
+        Q[torch.from_numpy(~masks)] = -np.inf # Remove impossible actions
+        orders = torch.argsort(Q, dim=1, descending=True).numpy()
+        explore = np.random.rand(len(states)) <= self.epsilon
+        return [np.random.permutation(np.where(mask)[0]) if random else order[:sum(mask)]
+                for mask, random, order in zip(masks, explore, orders)]
+
     def q_values(self, state):
         "Returns the Q values of each action given a state."
         state = T(state).reshape(1, self.state_size).to(self.device)
@@ -106,6 +118,10 @@ class DQNAgent:
                 ]
         self.memory.append(self.Transition(*info))
 
+    def memorize_batch(self, states, actions, energies, params, next_states):
+        "Remember the transitions of a batch of states."
+        for transition in zip(states, actions, energies, params, next_states): self.memorize(*transition)
+
     def act(self, state):
         """Take an action according to the epsilon-greedy policy"""
         mask = action_mask(state, self.N)  # Possible actions
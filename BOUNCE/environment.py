@@ -1,26 +1,103 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/00_environment.ipynb (unless otherwise specified).
 
-__all__ = ['SDPEnvironment']
+__all__ = ['screened_solve', 'claimed_solve', 'completed', 'then', 'SDPEnvironment', 'SQLiteMemory', 'read_memory',
+           'merge_memory', 'read_journal', 'append_journal', 'compact_memory', 'SharedMemory', 'MemoryManager',
+           'memory_manager', 'VecSDPEnvironment']
 
 # Cell
 import numpy as np
 import torch
 import itertools
+import time
 from copy import deepcopy
 from pathlib import Path
+import os
+import fcntl
 import pickle
+import sqlite3
+from collections.abc import MutableMapping
+from joblib import Parallel, delayed
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import Thread, Lock, Condition
+from multiprocessing.managers import BaseManager
+
+from bounce.sdp import solve_sdp, resolve_symmetries, ojimetro, key_parameters, SolverStats
+from bounce.utils import state2int, state2str, contained_constraints, simplify_layout, simplify_masks, fill_layout
+from bounce.utils import dist_poly, layout_key
 
-from bounce.sdp import solve_sdp, ojimetro
-from bounce.utils import state2int, state2str, contained_constraints, simplify_layout, fill_layout, dist_poly
+# Cell
+def screened_solve(layout, H, sdp_kwargs=None, warm_start=None, screening_kwargs=None, threshold=-np.inf):
+    "Solves the SDP of the layout with `sdp_kwargs`, screening it with `screening_kwargs` first, if given."
+    sdp_kwargs = {} if sdp_kwargs is None else sdp_kwargs
+    precision, rdms, infos = 'tight', warm_start, []
+    if screening_kwargs is not None:
+        energy, solution, info = solve_sdp(layout, H, warm_start=rdms, return_rdms=True, return_info=True,
+                                           **{**sdp_kwargs, **screening_kwargs})
+        infos.append(info)
+        if energy != 0: rdms = solution
+        if energy != 0 and energy < threshold: precision = 'loose'
+    if precision == 'tight' and not (infos and infos[-1]['timed_out']): # Hopeless after timing out
+        energy, solution, info = solve_sdp(layout, H, warm_start=rdms, return_rdms=True, return_info=True,
+                                           **sdp_kwargs)
+        infos.append(info)
+        if energy != 0: rdms = solution
+    return energy, rdms, precision, infos
+
+def claimed_solve(store, state, seen, lease, layout, H, **kwargs):
+    """`screened_solve` claiming the state in the `store` of a shared memory, if any, returning the claim token with the
+    solution. `None` if another process solved it in the meantime, waiting for it if needed."""
+    token = None if store is None else store.claim(state, seen, lease, os.getpid())
+    if store is not None and token is None: return None
+    try: return token, screened_solve(layout, H, **kwargs)
+    except BaseException:
+        if token is not None: store.release(state, token)
+        raise
+
+def completed(function, *args, **kwargs):
+    "Future holding the outcome of calling `function` right away."
+    future = Future()
+    try:                       future.set_result(function(*args, **kwargs))
+    except Exception as error: future.set_exception(error)
+    return future
+
+def then(future, function):
+    """Future with the outcome of `function` applied to the result of `future` once it is done. If the outcome is a
+    future itself, its own outcome."""
+    chained = Future()
+    def done(future):
+        try:
+            outcome = function(future.result())
+            if isinstance(outcome, Future): outcome.add_done_callback(relay)
+            else:                           chained.set_result(outcome)
+        except Exception as error: chained.set_exception(error)
+    def relay(outcome):
+        try:                       chained.set_result(outcome.result())
+        except Exception as error: chained.set_exception(error)
+    future.add_done_callback(done)
+    return chained
 
 # Cell
 class SDPEnvironment:
     "Environment for constraint-space exploration."
 
-    def __init__(self, N, H, param_profile, reward_criterion="energy_norm", energy_threshold=1e-3):
+    def __init__(self, N, H, param_profile, reward_criterion="energy_norm", energy_threshold=1e-3, sdp_kwargs=None,
+                 warm_start=True, screening=None, screening_kwargs=None, speculation=None, executor=None,
+                 store='pickle'):
 
         self.N = N # Number of sites
         self.H = H # Hamiltonian
+        self.sdp_kwargs = {} if sdp_kwargs is None else sdp_kwargs # Passed to `solve_sdp`, e.g., the backend
+        self.symmetries = resolve_symmetries(H, self.sdp_kwargs.get('backend', 'picos'),
+                                             self.sdp_kwargs.get('symmetries', 'auto')) # Reduce the parameters
+        self.warm_start = warm_start # Seed every SDP with the last solution
+        self.rdms = None             # Reduced density matrices of the last solution
+        self.screening = screening   # Margin below the best energy to refine low-precision bounds (None disables it)
+        self.screening_kwargs = {'tol': 1e-3} if screening_kwargs is None else screening_kwargs # Low-precision solve
+        self.speculation = speculation # Candidate actions solved in parallel by `perform_action` (None disables it)
+        self.executor = executor       # Pool solving the SDPs of the asynchronous API (None solves them in place)
+        self.store = store             # Memory storage: 'pickle' file, 'sqlite' database or 'shared' among processes
+        self.run_stats, self.episode_stats = SolverStats(), SolverStats() # Solver statistics
 
         # Parameter profile
         self.param_profile = param_profile
@@ -32,6 +109,9 @@ class SDPEnvironment:
 
         # Memory of visited states. It is a lookup table for computation speedup.
         self.memory_limit = 1e6
+        self.solutions = {} # Results of the SDPs solved by `layout_key`, shared by the states with the same layout
+        self._speculative = {} # Futures with the results of the states being solved by `_speculate`
+        self.compaction = 1. # Journal size, relative to the memory snapshot, that triggers its compaction
         self._get_memory()
 
         # Creating the agent basis
@@ -71,8 +151,10 @@ class SDPEnvironment:
         return [self.state[i:i+self.N] for i in range(0, len(self.state), self.N)]
 
     @property
-    def layout(self):
-        layout = simplify_layout([np.array(sites) for sites in self.layout_basis[self.state.astype(bool)]])
+    def layout(self): return self._layout(self.state)
+
+    def _layout(self, state):
+        layout = simplify_layout([np.array(sites) for sites in self.layout_basis[state.astype(bool)]])
         return fill_layout(layout, self.N)
 
     def show_constraints(self, state=None):
@@ -83,18 +165,43 @@ class SDPEnvironment:
     ## agent - environment interaction ##
     def perform_action(self, actions, it):
         "Receives a list of actions (priority ordered) and repeatedly tries to execute them until one is accepted."
+        return self.submit_action(actions, it).result()
+
+    def submit_action(self, actions, it):
+        """Asynchronous `perform_action`, returning a future with its results. The SDPs are solved by the `executor`
+        in the meantime, during which the environment must not be used."""
         state_0 = deepcopy(self.state)
-        for a in actions:
-            next_state, energy, params, err  = self.explorative_step(a, it) # Try action
-            if err:
-                self.state = deepcopy(state_0)
-                _, _, err = self.get_values()
-                if err: raise Exception(f"Error found undoing an action. Going back from "+
-                                        f"{next_state} to {self.state} with action {a}. Ref state is {state_0}")
-            else:
-                break
+        self.param_limit = self.param_profile(it)
+        next_states = self._next_states(actions)
+        feasible = self.get_params(next_states) <= self.param_limit
+        if feasible.any(): actions, next_states = [a for a, ok in zip(actions, feasible) if ok], next_states[feasible]
+        else:              actions, next_states = list(actions)[-1:], next_states[-1:]
+        if self.speculation: self._speculate(next_states)
+        known = self._lookup(state2int(state_0)) # Values to go back to the initial state without solving it
+        future = Future()
+        def settle(k, step, undo=None): # Outcome of trying the actions from the k-th one, `undo` going back from it
+            # Callbacks run on the thread delivering the results of the executor, so they never wait for a future
+            try:
+                while True:
+                    next_state, energy, params, err = step.result()
+                    if not err: break
+                    if undo is None:
+                        self.state = deepcopy(state_0)
+                        undo = self.submit_values() if isinstance(known, bool) else completed(lambda: known)
+                    else:
+                        _, _, err = undo.result()
+                        if err: raise Exception(f"Error found undoing an action. Going back from "+
+                                                f"{next_state} to {self.state} with action {actions[k]}. "+
+                                                f"Ref state is {state_0}")
+                        if k+1 == len(actions): break
+                        k, step, undo = k+1, self.submit_step(actions[k+1], it), None # Try the next action
+                    waiting = step if undo is None else undo
+                    if not waiting.done(): return waiting.add_done_callback(lambda _: settle(k, step, undo))
 #         _, next_state, _ = self._simplify_constraints() # In case we want to try with simplified states on the NN
-        return next_state, a, energy, params, err
+                future.set_result((next_state, actions[k], energy, params, err))
+            except Exception as error: future.set_exception(error)
+        self.submit_step(actions[0], it).add_done_callback(lambda step: settle(0, step))
+        return future
 
     def explorative_step(self, action, it):
         ''' Perform action over the current state and calculate/recalls the features
@@ -106,16 +213,22 @@ class SDPEnvironment:
                     - Parameters given the new constraints
                     - Energy of the new state
                     - Error'''
+        return self.submit_step(action, it).result()
 
+    def submit_step(self, action, it):
+        """Asynchronous `explorative_step`. The action is performed right away, and a future with the results is
+        returned while the `executor` solves the SDP, if needed."""
         if action < len(self.state):   self.state[action] = -self.state[action] + 1
         elif action > len(self.state): raise ValueError(f"Action {action} exceeds maximum index {len(self.state)}")
         # Case that action == len(self.state) the action is to remain in the current state
 
         self.state[contained_constraints(self.state, self.N)] = 1 # Include the smaller contained constraints
         self.param_limit = self.param_profile(it)
-        energy, params, err = self.get_values() # Calculate the features
-        if not err: self._min_max_update(energy, params)
+        return then(self.submit_values(), self._step_results) # Calculate the features
 
+    def _step_results(self, values):
+        energy, params, err = values
+        if not err: self._min_max_update(energy, params)
         return self.state, energy, params, err
 
 
@@ -153,47 +266,157 @@ class SDPEnvironment:
     ## SDP results ##
     def get_values(self):
         "Solve the associated SDP to the state and return the results."
-        binary = state2int(self.state)
-        if binary in self.memory.keys():
-            energy, params, err = self._remember(binary)
-            energy, params, err = self._check_current_limit(binary, energy, params, err)
-        else:
-            energy, params, err = self.get_sdp_results()
-            if len(self.memory) < self.memory_limit:
-                self._memorize(binary, [energy, params, err])
+        return self.submit_values().result()
 
+    def submit_values(self):
+        """Asynchronous `get_values`, returning a future with the results. They are recalled from memory when possible
+        and, otherwise, the SDP is solved by the `executor`."""
+        binary = state2int(self.state)
+        values = self._lookup(binary)
+        if not isinstance(values, bool): return completed(lambda: values)
+        if binary in self._speculative: return self._speculative.pop(binary)
+        layout, kwargs, claim = self.layout, self._solve_kwargs(screen=values), self._claim_args(binary)
+        solution = self._submit(claimed_solve, *claim, layout, self.H, **kwargs)
+        return then(solution, lambda solution: self._settle(binary, layout, solution, kwargs))
+
+    def _submit(self, function, *args, **kwargs):
+        "Future with the outcome of `function`, which is called by the `executor`, if any, or right away."
+        if self.executor is None: return completed(function, *args, **kwargs)
+        return self.executor.submit(function, *args, **kwargs)
+
+    def _settle(self, binary, layout, claimed, kwargs, warm=True):
+        """Results of a state given its `claimed_solve`, releasing the claim once they are kept. If another process
+        solved it, they are read from the shared memory, or a future with them if it must be solved again. With `warm`,
+        the solution is the next warm start."""
+        if claimed is None:
+            self.run_stats.coalesced += 1; self.episode_stats.coalesced += 1
+            self.memory.cache.pop(binary, None) # Read the new results
+            values = self._lookup(binary) if binary in self.memory else True
+            if not isinstance(values, bool): return values
+            solution = self._submit(screened_solve, layout, self.H, **kwargs) # Not kept, or not valid here
+            return then(solution, lambda solution: self._settle(binary, layout, (None, solution), kwargs, warm))
+        token, (energy, rdms, precision, infos) = claimed
+        try:     return self._keep(binary, layout, energy, rdms if warm else None, precision, infos)
+        finally:
+            if token is not None: self.memory.release(binary, token)
+
+    def _claim_args(self, binary):
+        "Arguments of `claimed_solve` claiming a state in the shared memory, if any."
+        if self.store != 'shared': return None, binary, None, None
+        timeout = self.sdp_kwargs.get('timeout')
+        lease = self.memory.lease if timeout is None else 2*timeout + 60. # Screened and high-precision solves
+        return self.memory.store, binary, self.memory.cache.get(binary), lease
+
+    def _keep(self, binary, layout, energy, rdms, precision, infos):
+        "Keeps the solution of the SDP of a layout, memorizing its results."
+        if rdms is not None: self.rdms = rdms
+        energy, params, err, info = self._results(layout, energy, precision, infos)
+        if binary in self.memory or self._has_room():
+            self._memorize(binary, [energy, params, err, info])
         return energy, params, err
 
-    def get_params(self):
-        "Estimates the free parameters needed to solve the SDP"
+    def get_params(self, states=None):
+        """Estimates the free parameters needed to solve the SDP of the current state or, if given, of every one of the
+        `states`, from the bitmasks of their constraints."""
+        if states is not None:
+            singles = [1 << n for n in range(self.N)] # Filling the layout
+            return np.array([key_parameters(simplify_masks([*self.basis_masks[state.astype(bool)], *singles]),
+                                            self.symmetries) for state in states])
         binary = state2int(self.state)
         if binary in self.memory.keys(): _, params, _ = self._remember(binary)
-        else:                            params = ojimetro(self.layout)
+        else:                            params = ojimetro(self.layout, self.symmetries)
         return params
 
-    def get_sdp_results(self):
-        "Computes the energy bound solving the associated SDP to the sate"
-        energy = solve_sdp(self.layout, self.H)
-        params = ojimetro(self.layout)
-        if energy == 0:                 err = 1
+    def get_sdp_results(self, screen=True):
+        "Computes the energy bound solving the associated SDP to the sate."
+        energy, rdms, precision, infos = screened_solve(self.layout, self.H, **self._solve_kwargs(screen))
+        if rdms is not None: self.rdms = rdms
+        return self._results(self.layout, energy, precision, infos)
+
+    def _solve_kwargs(self, screen=True):
+        "Arguments of `screened_solve` for the current warm start and screening margin."
+        screen = screen and self.screening is not None
+        return {'sdp_kwargs': self.sdp_kwargs, 'warm_start': self.rdms if self.warm_start else None,
+                'screening_kwargs': self.screening_kwargs if screen else None,
+                'threshold': self.best[0] - self.screening if screen else -np.inf}
+
+    def _results(self, layout, energy, precision, infos):
+        """Results of the SDP of a layout given its solution, adding the `infos` of its solves to the statistics. They
+        are kept in `solutions` for the states with the same layout."""
+        for info in infos: self.run_stats.add(info); self.episode_stats.add(info)
+        params = ojimetro(layout, self.symmetries)
+        if energy == 0:                 err = 3 if infos[-1]['timed_out'] else 1
         elif params > self.param_limit: err = 2
         else:                           err = 0
-        return energy, params, err
+        info = {'precision': precision, 'solver': infos[-1]['solver'], 'time': sum(info['time'] for info in infos),
+                'limits': self.solve_limits}
+        key = layout_key(layout)
+        if key not in self.solutions and len(self.solutions) >= self.memory_limit:
+            del self.solutions[next(iter(self.solutions))] # Evict the oldest one
+        merge_memory(self.solutions, [(key, [energy, params, err, info])])
+        return energy, params, err, info
+
+    def _speculate(self, states):
+        """Solves in parallel the SDPs of the first `speculation` states that are not in memory, and memorizes their
+        results for when they are visited. With an `executor`, they are solved by it without waiting for them."""
+        pending, self._speculative = {}, {} # One state for every distinct layout
+        for state in states:
+            binary = state2int(state)
+            if self._recall(binary, state) is None and len(pending) < self.speculation:
+                layout = self._layout(state)
+                pending.setdefault(layout_key(layout), (binary, layout))
+        if len(pending) < 2 or not self._has_room(len(pending)): return
+        kwargs = self._solve_kwargs()
+        if self.executor is not None:
+            for binary, layout in pending.values():
+                solution = self.executor.submit(claimed_solve, *self._claim_args(binary), layout, self.H, **kwargs)
+                self._speculative[binary] = then(solution, lambda claimed, binary=binary, layout=layout:
+                                                 self._settle(binary, layout, claimed, kwargs, warm=False))
+            return
+        solutions = Parallel(n_jobs=len(pending))(delayed(claimed_solve)(*self._claim_args(binary), layout, self.H,
+                                                                         **kwargs)
+                                                  for binary, layout in pending.values())
+        for (binary, layout), claimed in zip(pending.values(), solutions):
+            self._settle(binary, layout, claimed, kwargs, warm=False)
 
-    def _check_current_limit(self, binary, energy, params, err):
+    @property
+    def solve_limits(self):
+        "Wall-clock and iteration limits of every solve, set through `sdp_kwargs`."
+        return {key: self.sdp_kwargs.get(key) for key in ('timeout', 'max_iters')}
+
+    def _promising(self, energy):
+        "Whether a bound must be solved with high precision given the screening margin."
+        return self.screening is None or energy >= self.best[0] - self.screening
+
+    def _lookup(self, binary, state=None):
+        """Results of a state (the current one by default) in memory given the current limits. If its SDP must be
+        solved (again), whether it can be screened."""
+        values = self._recall(binary, self.state if state is None else state)
+        if values is None: return True
+        energy, params, err = values[:3]
         if not err and params > self.param_limit:
             # Pre-computed parameters are larger than current limit
-            err, energy = 2, 0.
-        elif err == 2 and params <= self.param_limit or err==1:
+            return 0., params, 2
+        if err == 2 and params <= self.param_limit or err==1 or err == 3 and self._limits_changed(values):
             # If the error was due to excess of parameters but it fits now, recompute the SDP
-            energy, params, err = self.get_sdp_results()
-            self._memorize(binary, [energy, params, err])
-
+            # Timed-out layouts are only recomputed when the limits change
+            return True
+        if not err and self._precision(values) == 'loose' and self._promising(energy):
+            # Screened bound that has become competitive
+            return False
         return energy, params, err
 
-    def _min_max_update(self, energy, params):
+    def _recall(self, binary, state):
+        """Memorized results of a state or, otherwise, the ones of an SDP solved for another state with the same layout,
+        which are memorized for the state. `None` if there are none."""
+        if binary in self.memory: return self.memory[binary]
+        values = self.solutions.get(layout_key(self._layout(state)))
+        if values is not None and self._has_room(): self._memorize(binary, list(values))
+        return values
+
+    def _min_max_update(self, energy, params, state=None):
         """Given a a new obtained set of energy and parameters, check whether they are higher or lower than the max and min
-        values obtained previously and update them."""
+        values obtained previously and update them. They come from the current state, unless another one is given."""
         if params < self.min_params: self.min_params = params
         if params > self.max_params: self.max_params = params
         if energy < self.min_energy: self.min_energy = energy
@@ -203,13 +426,13 @@ class SDPEnvironment:
         if energy > self.best[0] and np.abs(energy-self.best[0]) > self.E_threshold:
             # If energy beyond threshold, keep it all
             self.best = np.array([energy, params, params])
-            self.best_layout = deepcopy(self.layout)
+            self.best_layout = deepcopy(self.layout if state is None else self._layout(state))
 
         elif np.abs(energy-self.best[0]) < self.E_threshold:
             # If energy within threshold
             if   params < self.best[1]:
                 self.best[0], self.best[1] = energy, params
-                self.best_layout = deepcopy(self.layout)
+                self.best_layout = deepcopy(self.layout if state is None else self._layout(state))
             elif params > self.best[2]:
                 self.best[2] = params
 
@@ -226,6 +449,15 @@ class SDPEnvironment:
             state[idx1, idx2] = 1
         return state.reshape(self.state.shape)
 
+    def _next_states(self, actions):
+        "States resulting from every action over the current one, including the smaller contained constraints."
+        actions = np.asarray(actions, dtype=int)
+        if (actions > len(self.state)).any(): raise ValueError(f"Actions exceed maximum index {len(self.state)}")
+        states, flips = np.repeat(self.state[None].astype(int), len(actions), axis=0), actions < len(self.state)
+        states[flips, actions[flips]] = 1 - states[flips, actions[flips]]
+        for state in states: state[contained_constraints(state, self.N)] = 1
+        return states
+
     def _simplify_constraints(self):
         "Simplifies current state removing contained constraints."
         state_simp = deepcopy(self.state)
@@ -234,11 +466,17 @@ class SDPEnvironment:
 
     ## Memory methods ##
     def save_memory(self):
-        old_memory = self._read_memory()
-        full_memory = {**old_memory, **self.memory}
-        with open(self.memory_path, "wb") as f:
-            pickle.dump(full_memory, f, protocol=pickle.HIGHEST_PROTOCOL)
-        self.memory = self._read_memory()
+        """Appends the results obtained since the last save to the journal of the memory. Once the journal is as large
+        as the snapshot, it is merged into it in the background, returning the thread that compacts it."""
+        if self.store == 'sqlite': return # Every result is already committed
+        append_journal(self.memory_path, self._unsaved.items())
+        self._unsaved = {}
+        journal, snapshot = _journal_path(self.memory_path), Path(self.memory_path)
+        snapshot_size = snapshot.stat().st_size if snapshot.exists() else 0
+        if journal.exists() and journal.stat().st_size >= self.compaction*snapshot_size:
+            compaction = Thread(target=compact_memory, args=(self.memory_path,))
+            compaction.start()
+            return compaction
 
     def _get_memory(self):
         "Reads the corresponding memory file"
@@ -252,31 +490,60 @@ class SDPEnvironment:
         else:
             self.memory_path = memory_dir/(f"env_memory_{self.H.model}_N{self.N}" +
                                     f"_B{state2str(self.H.linear)}_J{state2str(self.H.quadratic)}.pkl")
-        self.memory = self._read_memory()
+        # The amount of parameters depends on the symmetries used to reduce the SDP
+        reduced = [s for s in self.symmetries if s in ('real', 'parity')]
+        if reduced: self.memory_path = memory_dir/f"{self.memory_path.stem}_{'_'.join(reduced)}.pkl"
+        if self.store == 'sqlite':
+            self.memory = SQLiteMemory(self.memory_path.with_suffix('.sqlite'))
+            if not len(self.memory): self.memory.update(self._read_memory()) # Import the pickled memory, if any
+        elif self.store == 'shared':
+            self.memory = SharedMemory()
+            self.memory.update(self._read_memory())
+        else:
+            self.memory = self._read_memory()
+        self._unsaved = {} # Results not in the journal yet
+        self._count, self._recount, self._checks = self.memory_limit, 0, 0 # Running memory count, see `_has_room`
 
     def _memorize(self, constraint, values):
         "Add to memory the states visited and the values of the SDP for each iteration"
-        energy, params, err = values
+        energy, params, err = values[:3]
 
         if constraint in self.memory.keys() and params > self.param_limit and err != 2:
             _, _, old_err = self._remember(constraint)
-            if old_err != 1:
+            if old_err not in (1, 3):
                 raise Exception(f"Trying to memorize constraint with binary index {constraint} already in memory")
         elif not isinstance(constraint, int):
             raise ValueError(f"Constraint is not a binary integer {constraint}")
         else:
+            if constraint not in self.memory: self._count += 1
             self.memory[constraint] = values
+            if self.store != 'sqlite': self._unsaved[constraint] = values
+
+    def _has_room(self, entries=1):
+        "Whether the `entries` fit in memory given the `memory_limit`"
+        # Counting is a full scan for `SQLiteMemory` and a round trip for `SharedMemory`: only count again when the
+        # running count reaches the limit, and at most every 1000 checks while the memory is full
+        self._checks += 1
+        if self._count + entries > self.memory_limit and self._checks >= self._recount:
+            self._count, self._recount = len(self.memory), self._checks + 1000
+        return self._count + entries <= self.memory_limit
 
     def _remember(self, constraint):
         "Given a set of constraint, outputs the values of the SDP."
-        return self.memory[constraint]
+        return self.memory[constraint][:3]
+
+    def _limits_changed(self, values):
+        "Whether the solve limits have changed since the SDP of some memorized results was solved."
+        return len(values) < 4 or values[3].get('limits') != self.solve_limits
+
+    @staticmethod
+    def _precision(values):
+        "Precision of the SDP solution of a memory entry. Entries without it were solved with high precision."
+        return values[3].get('precision', 'tight') if len(values) > 3 else 'tight'
 
     def _read_memory(self):
-        try:
-            with open(self.memory_path, "rb") as f:
-                memory = pickle.load(f)
-        except: memory = {}
-        return memory
+        "Snapshot of the memory with its journal replayed on top."
+        return read_memory(self.memory_path)
 
     ## Agent action basis methods ##
     def _get_agent_basis(self, local_hamiltonian = True):
@@ -315,6 +582,7 @@ class SDPEnvironment:
         for item in a:
             self.layout_basis.append([int(s) for s in item.split(sep=" ") if s.isdigit()])
         self.layout_basis = np.array(self.layout_basis)
+        self.basis_masks = np.array([sum(1 << s for s in sites) for sites in self.layout_basis], dtype=object)
 
     def _constrain_basis(self):
         """Given the maximum allowed of parameters, this function redefines the basis
@@ -357,4 +625,334 @@ class SDPEnvironment:
                 self.state[size*self.N:size*self.N + k] = 1
                 params = self.get_params()
                 if params > self.param_profile.max_params: k-=1; break
-            self.max_const_by_size.append(k+1)
\ No newline at end of file
+            self.max_const_by_size.append(k+1)
+
+# Cell
+class SQLiteMemory(MutableMapping):
+    "Memory of SDP results in the SQLite database at `path`, which many processes can use at once."
+    _upsert = ("INSERT INTO memory VALUES (?, ?, ?, ?) ON CONFLICT(state) DO UPDATE SET err = excluded.err, "
+               "precision = excluded.precision, value = excluded.value "
+               "WHERE excluded.precision = 'tight' OR memory.precision = 'loose' OR memory.err != 0")
+
+    def __init__(self, path, timeout=60.):
+        self.path, self.timeout = Path(path), timeout # Seconds waiting for other writers
+        self._connect()
+
+    def _connect(self):
+        self.connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL") # Readers and writers do not block each other
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS memory "
+                                "(state TEXT PRIMARY KEY, err INTEGER, precision TEXT, value BLOB)")
+
+    def __getstate__(self): return {'path': self.path, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._connect()
+
+    def __getitem__(self, state):
+        row = self.connection.execute("SELECT value FROM memory WHERE state = ?", (str(state),)).fetchone()
+        if row is None: raise KeyError(state)
+        return pickle.loads(row[0])
+
+    def __contains__(self, state):
+        return self.connection.execute("SELECT 1 FROM memory WHERE state = ?", (str(state),)).fetchone() is not None
+
+    def __setitem__(self, state, values): self.connection.execute(self._upsert, self._row(state, values))
+
+    def __delitem__(self, state):
+        if not self.connection.execute("DELETE FROM memory WHERE state = ?", (str(state),)).rowcount:
+            raise KeyError(state)
+
+    def __iter__(self):
+        return (int(state) for state, in self.connection.execute("SELECT state FROM memory").fetchall())
+
+    def __len__(self): return self.connection.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+
+    def update(self, entries=()):
+        "Writes several entries in a single transaction."
+        entries = entries.items() if hasattr(entries, 'items') else entries
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:    self.connection.executemany(self._upsert, [self._row(state, values) for state, values in entries])
+        except: self.connection.execute("ROLLBACK"); raise
+        self.connection.execute("COMMIT")
+
+    @staticmethod
+    def _row(state, values):
+        return (str(state), int(values[2]), SDPEnvironment._precision(values),
+                pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL))
+
+# Cell
+def read_memory(path):
+    "Memory stored at `path`: its last snapshot with the journals of the later results replayed on top."
+    with _locked(path, 'journal', shared=True): # Neither appended to nor compacted meanwhile
+        memory = _read_snapshot(path)
+        for journal in (_journal_path(path, 'compacting'), _journal_path(path)):
+            merge_memory(memory, read_journal(journal))
+    return memory
+
+def merge_memory(memory, entries):
+    """Adds the `(state, values)` entries to the memory, where high-precision results take priority over screened ones,
+    unless they are errors."""
+    for state, values in entries:
+        tight, old = SDPEnvironment._precision(values) == "tight", memory.get(state, values)
+        if tight or SDPEnvironment._precision(old) == "loose" or old[2] != 0:
+            memory[state] = values
+    return memory
+
+def read_journal(path):
+    "Entries of the journal at `path` in the order they were appended, ignoring a truncated last one."
+    entries = []
+    try:
+        with open(path, "rb") as f:
+            while True: entries.append(pickle.load(f))
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError): pass
+    return entries
+
+def append_journal(path, entries):
+    "Appends the `(state, values)` entries to the journal of the memory at `path` at once."
+    data = b''.join(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL) for entry in entries)
+    if not data: return
+    with _locked(path, 'journal'):
+        with open(_journal_path(path), "ab") as f: f.write(data)
+
+def compact_memory(path):
+    """Merges the journal into the snapshot of the memory at `path`, which is replaced atomically. The results appended
+    in the meantime go to a new journal. Nothing is done while another process compacts the memory."""
+    with _locked(path, 'compaction', blocking=False) as acquired:
+        if not acquired: return
+        journal, compacting = _journal_path(path), _journal_path(path, 'compacting')
+        with _locked(path, 'journal'):
+            if journal.exists() and not compacting.exists(): journal.rename(compacting) # Else, left by a crash
+        memory = merge_memory(_read_snapshot(path), read_journal(compacting))
+        with open(path.with_suffix('.tmp'), "wb") as f: pickle.dump(memory, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with _locked(path, 'journal'):
+            os.replace(path.with_suffix('.tmp'), path)
+            if compacting.exists(): compacting.unlink()
+
+def _read_snapshot(path):
+    try:
+        with open(path, "rb") as f: return pickle.load(f)
+    except (FileNotFoundError, EOFError): return {}
+
+def _journal_path(path, kind='journal'): return Path(path).with_suffix(f'.{kind}')
+
+@contextmanager
+def _locked(path, name, blocking=True, shared=False):
+    "Holds the `name` lock of the memory at `path` across processes, providing whether it was acquired."
+    with open(Path(path).with_suffix(f'.{name}.lock'), "a") as f:
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try: fcntl.flock(f, mode if blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:     yield True
+        finally: fcntl.flock(f, fcntl.LOCK_UN)
+
+# Cell
+class SharedMemory(MutableMapping):
+    "Memory of SDP results shared among processes through a `MemoryManager` server."
+    def __init__(self, store=None, cache=None, lease=300.):
+        self.store = memory_manager().Store() if store is None else store
+        self.cache = {} if cache is None else cache
+        self.lease = lease # Seconds after which the claim of a state is taken over, unless the solves have a timeout
+
+    def __getitem__(self, state):
+        if state not in self.cache:
+            values = self.store.get(state)
+            if values is None: raise KeyError(state)
+            self.cache[state] = values
+        return self.cache[state]
+
+    def __setitem__(self, state, values): self.cache[state] = self.store.put(state, values)
+
+    def __delitem__(self, state):
+        self.cache.pop(state, None)
+        if not self.store.delete(state): raise KeyError(state)
+
+    def __iter__(self): return iter(self.store.keys())
+
+    def __len__(self): return self.store.size()
+
+    def claim(self, state):
+        "Token to `release` the claim to solve a state, or `None` if another process solved it meanwhile."
+        token = self.store.claim(state, self.cache.get(state), self.lease, os.getpid())
+        if token is None: self.cache.pop(state, None) # Read the new result
+        return token
+
+    def release(self, state, token): self.store.release(state, token)
+
+    @property
+    def coalesced(self):
+        "Solves avoided by all the processes because the SDP was being solved, or had just been solved, by another."
+        return self.store.coalesced()
+
+    def update(self, other=(), **kwargs):
+        "Merges many entries into the shared store at once."
+        self.store.update(dict(other, **kwargs))
+
+    def __deepcopy__(self, memo): return SharedMemory(self.store, deepcopy(self.cache, memo), self.lease)
+
+    def __getstate__(self): return {'store': pickle.dumps(self.store), 'cache': self.cache, 'lease': self.lease}
+
+    def __setstate__(self, state):
+        self.cache, self.lease = state['cache'], state['lease']
+        try: self.store = pickle.loads(state['store'])
+        except OSError: # The server is gone, e.g., loading a checkpoint, so the cache seeds a new one
+            self.store = memory_manager().Store()
+            self.store.update(self.cache)
+
+class _Store:
+    "Results of a `SharedMemory`, kept by the `MemoryManager` server, and the states being solved."
+    def __init__(self):
+        self.memory, self.lock = {}, Lock()
+        self.pending, self.released, self.n_coalesced = {}, Condition(self.lock), 0 # State claims and their leases
+        self.tokens = itertools.count()
+
+    def claim(self, state, seen, lease, owner=None):
+        with self.lock:
+            waited = False
+            while state in self.pending:
+                _, deadline, holder = self.pending[state]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not _alive(holder): break # The owner is gone, so it is taken over
+                waited = True
+                self.released.wait(min(remaining, 1.)) # Checking every second whether the owner is alive
+            if state not in self.pending and (waited or self.memory.get(state) != seen): # Solved meanwhile
+                self.n_coalesced += 1
+                return None
+            token = next(self.tokens)
+            self.pending[state] = token, time.monotonic() + lease, owner
+            return token
+
+    def release(self, state, token):
+        with self.lock:
+            if self.pending.get(state, (None,))[0] == token: del self.pending[state]
+            self.released.notify_all()
+
+    def coalesced(self): return self.n_coalesced
+
+    def get(self, state): return self.memory.get(state)
+
+    def put(self, state, values):
+        with self.lock: return merge_memory(self.memory, [(state, values)])[state]
+
+    def update(self, memory):
+        with self.lock: merge_memory(self.memory, memory.items())
+
+    def delete(self, state): return self.memory.pop(state, None) is not None
+
+    def size(self): return len(self.memory)
+
+    def keys(self): return list(self.memory)
+
+def _alive(pid):
+    "Whether the process `pid` is running. Claims without an owner are assumed to be alive."
+    if pid is None: return True
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: pass
+    return True
+
+class MemoryManager(BaseManager):
+    "Server process of the `SharedMemory` stores."
+
+MemoryManager.register('Store', _Store)
+
+_manager = None
+def memory_manager():
+    "`MemoryManager` of this process, started the first time it is needed."
+    global _manager
+    if _manager is None:
+        _manager = MemoryManager()
+        _manager.start()
+    return _manager
+
+# Cell
+class VecSDPEnvironment:
+    "Batch of states exploring the constraint space of an `SDPEnvironment`, with which they share the memory."
+
+    def __init__(self, env, n_states, n_jobs=None):
+        self.env, self.N = env, env.N
+        self.n_jobs = n_states if n_jobs is None else n_jobs
+        basis = np.eye(len(env.layout_basis), dtype=int)
+        self.containment = np.array([contained_constraints(s, self.N) for s in basis]) # Contained in each constraint
+        self.states = np.zeros((n_states, len(env.layout_basis)), dtype=int)
+
+    def reset(self):
+        "Resets all the states to the initial one."
+        self.states = np.zeros_like(self.states)
+        return self.states
+
+    def contained_constraints(self, states=None):
+        "Boolean mask of the constraints contained within a larger one in every state."
+        states = self.states if states is None else states
+        return states @ self.containment > 0
+
+    def action_masks(self, states=None):
+        "Mask of the actions that can be performed from every state."
+        masks = ~self.contained_constraints(states)
+        return np.hstack([masks, np.ones((len(masks), 1), dtype=bool)])
+
+    def next_states(self, actions, states=None):
+        "States resulting from one action over every state, including the smaller contained constraints."
+        states = (self.states if states is None else states).copy()
+        actions = np.asarray(actions, dtype=int)
+        rows = np.flatnonzero(actions < states.shape[1]) # The last action remains in the state
+        states[rows, actions[rows]] = 1 - states[rows, actions[rows]]
+        states[self.contained_constraints(states)] = 1
+        return states
+
+    def perform_actions(self, actions, it):
+        "Executes the first accepted action of every state, as `SDPEnvironment.perform_action`."
+        env = self.env
+        env.param_limit = env.param_profile(it)
+        rows = np.repeat(np.arange(len(self.states)), [len(a) for a in actions])
+        flat = np.concatenate([np.asarray(a, dtype=int) for a in actions])
+        feasible = env.get_params(self.next_states(flat, self.states[rows])) <= env.param_limit
+        candidates = []
+        for k in range(len(self.states)):
+            accepted = flat[(rows == k) & feasible]
+            candidates.append(list(accepted) if len(accepted) else list(flat[rows == k][-1:]))
+        next_states, tried = self.states.copy(), np.zeros(len(self.states), dtype=int)
+        energies, params, errs = np.zeros(len(self.states)), np.zeros(len(self.states)), np.zeros(len(self.states), int)
+        pending = np.array([k for k in range(len(self.states)) if candidates[k]], dtype=int)
+        while len(pending):
+            tried[pending] = [candidates[k].pop(0) for k in pending]
+            next_states[pending] = self.next_states(tried[pending], self.states[pending])
+            energies[pending], params[pending], errs[pending] = self.get_values(next_states[pending])
+            pending = np.array([k for k in pending if errs[k] and candidates[k]], dtype=int)
+        self.states[errs == 0] = next_states[errs == 0]
+        return next_states, tried, energies, params, errs
+
+    def get_values(self, states=None):
+        "Energies, parameters and errors of the SDPs of every state, as `SDPEnvironment.get_values`."
+        env = self.env
+        states = self.states if states is None else states
+        binaries = [state2int(state) for state in states]
+        values = {binary: env._lookup(binary, state) for binary, state in zip(binaries, states)}
+        misses = {binary: env._layout(state) for binary, state in zip(binaries, states)
+                  if isinstance(values[binary], bool)}
+        if misses:
+            keys = {binary: layout_key(layout) for binary, layout in misses.items()}
+            distinct = {key: binary for binary, key in keys.items()} # One state for every distinct layout
+            kwargs = {binary: env._solve_kwargs(screen=values[binary]) for binary in distinct.values()}
+            solutions = Parallel(n_jobs=min(self.n_jobs, len(distinct)))(
+                delayed(claimed_solve)(*env._claim_args(binary), misses[binary], env.H, **kwargs[binary])
+                for binary in distinct.values())
+            results = {key: env._settle(binary, misses[binary], claimed, kwargs[binary], warm=False)
+                       for (key, binary), claimed in zip(distinct.items(), solutions)}
+            results = {key: result.result() if isinstance(result, Future) else result # Solved again
+                       for key, result in results.items()}
+            for binary, key in keys.items():
+                values[binary], solved = results[key], distinct[key] # The state whose SDP was solved for the layout
+                if binary == solved or solved not in env.memory: continue
+                if binary in env.memory or env._has_room():
+                    env._memorize(binary, list(env.memory[solved]))
+        for binary, state in dict(zip(binaries, states)).items():
+            energy, params, err = values[binary]
+            if not err: env._min_max_update(energy, params, state)
+        energies, params, errs = zip(*[values[binary] for binary in binaries])
+        return np.array(energies), np.array(params), np.array(errs)
\ No newline at end of file
@@ -21,6 +21,23 @@ class Hamiltonian1D:
         self.linear = linear
         self.quadratic = quadratic
 
+    @property
+    def symmetries(self):
+        "Symmetries of the Hamiltonian that can be exploited to reduce the size of the SDP, found the first time."
+        if getattr(self, '_symmetries', None) is None: self._symmetries = self._find_symmetries()
+        return self._symmetries
+
+    def _find_symmetries(self):
+        symmetries = []
+        if np.allclose(self.linear, self.linear[0]) and np.allclose(self.quadratic, self.quadratic[0]):
+            symmetries.append('translation')
+        terms = [picos.expressions.data.cvx2np(h.value) for _, h in self.to_sdp()]
+        if all(np.allclose(h.imag, 0) for h in terms): symmetries.append('real')
+        # Terms commuting with the parity operator Z⊗...⊗Z, which is diagonal
+        parities = [np.array([(-1)**bin(i).count('1') for i in range(len(h))]) for h in terms]
+        if all(np.allclose(h, np.outer(p, p)*h) for h, p in zip(terms, parities)): symmetries.append('parity')
+        return symmetries
+
     def draw_system(self, figsize=(8,6), cmap=plt.cm.plasma):
         "Conceptual drawing of the system showing interaction strength and on-site field."
         G = nx.Graph()
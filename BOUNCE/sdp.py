@@ -1,60 +1,191 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/06_sdp.ipynb (unless otherwise specified).
 
-__all__ = ['solve_sdp', 'complementary_system', 'picos2np', 'ojimetro']
+__all__ = ['solve_sdp', 'SolveTimeout', 'run_limited', 'resolve_symmetries', 'PhaseTimer', 'cvxopt_stats',
+           'SolverStats', 'compile_layout', 'hamiltonian_terms', 'complementary_system', 'picos2np',
+           'compatibility_pairs', 'normalization_roots', 'overlap', 'partial_trace_indices', 'partial_trace',
+           'embed_operator', 'hermitian_dual', 'SDPTemplate', 'ConicTemplate', 'translation_invariant',
+           'translation_representatives', 'expectation', 'pauli_key', 'local_paulis', 'pauli_matrix',
+           'lmi_coefficients', 'PAULIS', 'ADMMTemplate', 'project_rdms', 'simplex_projection', 'minimum_eigenvalues',
+           'pauli_basis', 'TEMPLATES', 'register_solver', 'route_layout', 'SOLVERS', 'ROUTES', 'cost_model',
+           'preflight', 'calibrate_preflight', 'PREFLIGHT', 'BENCHMARKS', 'ojimetro', 'key_parameters',
+           'free_parameters']
 
 # Cell
+import time
+import resource
 import picos
+import inspect
+import itertools
 import numpy as np
-from bounce.utils import state2str, simplify_layout
+from cvxopt import matrix, spmatrix, solvers
+from functools import lru_cache, reduce
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, current_process
+from joblib import Parallel, delayed
+from bounce.hamiltonian import XXHamiltonian
+from bounce.utils import state2str, simplify_layout, layout_key, simplify_masks
 
 # Cell
-def solve_sdp(layout, hamiltonian):
-    "Solves the SDP defined by the given layout and Hamiltonian."
-    layout = simplify_layout(layout)
-    H = hamiltonian.to_sdp()
-    problem = picos.Problem(solver = 'cvxopt')
-    variables = [(site, picos.HermitianVariable('rho'+','.join(map(str, site)), (2**len(site), 2**len(site)))) for site in layout]
-    problem.add_list_of_constraints([rho >> 0 for _, rho in variables])
-    problem.add_list_of_constraints([picos.trace(rho) == 1 for _, rho in variables])
-
-    # Energy
-    objective = 0
-    for support, h in H:
-        supported = False
-        for sites, rho in variables:
-            common, _, idx = np.intersect1d(support, sites, return_indices=True)
-            if len(common) == len(support):
-                rdm = rho.partial_trace(complementary_system(idx, len(sites)))
-                objective += (rdm | h) # Tr(rdm·H')
-                supported = True
-                break
-        if not supported:
-            eigenvalues, _ = np.linalg.eigh(picos2np(h))
-            objective += min(eigenvalues)
-
-    problem.set_objective('min', objective)
-
-    # Compatibility
-    compatibility_constraints = []
-    for k1, (sites1, rho1) in enumerate(variables):
-        for k2 in range(k1+1, len(variables)):
-            sites2, rho2 = variables[k2]
-            common, idx1, idx2 = np.intersect1d(sites1, sites2, return_indices=True)
-            if len(common) > 0:
-                partial_trace1 = rho1.partial_trace(complementary_system(idx1, len(sites1)))
-                partial_trace2 = rho2.partial_trace(complementary_system(idx2, len(sites2)))
-                constraint = partial_trace1 - partial_trace2 == 0
-                compatibility_constraints.append(constraint)
-
-    problem.add_list_of_constraints(compatibility_constraints)
+def solve_sdp(layout, hamiltonian, backend='picos', symmetries='auto', warm_start=None, return_rdms=False,
+              return_info=False, limits=None, timeout=None, **kwargs):
+    "Solves the SDP defined by the given layout and Hamiltonian with `backend`."
+    if backend == 'auto': backend = route_layout(layout, resolve_symmetries(hamiltonian, backend, symmetries))
+    chain = [backend] if isinstance(backend, str) else list(backend)
+    start, failed, rejected, timed_out, errors, stats, used = time.perf_counter(), [], [], [], {}, {}, None
+    result = (0., {}) if return_rdms else 0.
+    for solver in chain:
+        if solver not in SOLVERS: raise ValueError(f"Unknown solver {solver}. Choose one from {list(SOLVERS)}")
+        name, options = SOLVERS[solver]
+        solver_symmetries = resolve_symmetries(hamiltonian, solver, symmetries)
+        prediction = preflight(layout, solver, solver_symmetries) if limits or return_info else None
+        if limits and any(prediction[key] > limit for key, limit in limits.items()):
+            rejected.append(solver)
+            continue
+        try:
+            timer = PhaseTimer()
+            with timer('compile'):
+                template = compile_layout(layout, backend=name, symmetries=solver_symmetries, N=hamiltonian.N)
+            parameters = inspect.signature(template.solve).parameters
+            solve_kwargs = {'warm_start': warm_start, 'return_rdms': return_rdms, **options,
+                            **{k: v for k, v in kwargs.items() if k in parameters}}
+            if timeout is None: result, template_info = _solve_template(template, hamiltonian, **solve_kwargs)
+            else:               result, template_info = run_limited(_solve_template, timeout, template, hamiltonian,
+                                                                    **solve_kwargs)
+            stats = {**template_info, 'phases': {**timer.phases, **template_info.get('phases', {})},
+                     'preflight': prediction}
+            if template_info.get('error'): errors[solver] = template_info['error'] # Failed within the solver
+        except SolveTimeout:
+            result = (0., {}) if return_rdms else 0.
+            timed_out.append(solver)
+        except (MemoryError, RuntimeError, picos.solvers.SolverError) as error: # Out of memory or unavailable
+            result = (0., {}) if return_rdms else 0.
+            errors[solver] = f"{type(error).__name__}: {error}"
+        if (result[0] if return_rdms else result) != 0:
+            used = solver
+            break
+        failed.append(solver)
+    if not return_info: return result
+    info = {**stats, 'solver': used, 'time': time.perf_counter() - start, 'failed': failed, 'rejected': rejected,
+            'timed_out': timed_out, 'errors': errors}
+    return (*result, info) if return_rdms else (result, info)
+
+def _solve_template(template, hamiltonian, **kwargs):
+    "Solves the SDP of a `template`, providing the statistics of the solve with the result."
+    result = template.solve(hamiltonian, **kwargs)
+    return result, template.info
+
+class SolveTimeout(Exception):
+    "A solve exceeded its wall-clock limit and its worker was killed."
 
+def run_limited(function, timeout, *args, **kwargs):
+    "Runs `function` in a forked worker process that is killed after `timeout` seconds, raising `SolveTimeout`."
+    if current_process().daemon: # E.g., a worker of `multiprocessing.Pool`, which cannot have children
+        raise RuntimeError("Solves with a timeout cannot run in a daemonic process")
+    context = get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    def work():
+        try:                     outcome = (True, function(*args, **kwargs))
+        except Exception as error: outcome = (False, error)
+        try:                     sender.send(outcome)
+        except Exception as error: sender.send((False, RuntimeError(f"Unpicklable outcome: {error!r}")))
+    worker = context.Process(target=work)
+    worker.start()
+    sender.close()
     try:
-        problem.solve()
-        result = np.real(objective.value)
-    except:
-        print(problem)
-        result = 0.
-    return result
+        if not receiver.poll(timeout):
+            worker.kill()
+            raise SolveTimeout(f"Solve exceeded {timeout} s")
+        finished, value = receiver.recv()
+    except EOFError: # The worker died without an outcome, e.g., killed for using too much memory
+        worker.join()
+        raise RuntimeError(f"Solver worker died with exit code {worker.exitcode}") from None
+    finally:
+        receiver.close()
+        worker.join()
+    if not finished: raise value
+    return value
+
+def resolve_symmetries(hamiltonian, backend='picos', symmetries='auto'):
+    """Symmetries exploited by `solve_sdp`. With 'auto', all the ones of the Hamiltonian supported by the solver
+    `backend`, the first one of a chain or the first one for small layouts if it is routed."""
+    if symmetries != 'auto': return list(symmetries)
+    if backend == 'auto': backend = ROUTES[0][1]
+    solver = backend if isinstance(backend, str) else backend[0]
+    supported = getattr(TEMPLATES.get(SOLVERS.get(solver, (None,))[0]), 'supported_symmetries', ())
+    return [s for s in getattr(hamiltonian, 'symmetries', []) if s in supported]
+
+class PhaseTimer:
+    "Wall time spent in every phase of a computation, which is timed with `with timer(phase):`."
+    def __init__(self): self.phases = {}
+
+    @contextmanager
+    def __call__(self, phase):
+        start = time.perf_counter()
+        try:     yield
+        finally: self.phases[phase] = self.phases.get(phase, 0.) + time.perf_counter() - start
+
+def cvxopt_stats(solution):
+    "Iterations and final primal and dual residuals of a cvxopt `solution`, if any."
+    if solution is None: return {}
+    return {'iterations': solution['iterations'], 'primal_residual': solution['primal infeasibility'],
+            'dual_residual': solution['dual infeasibility']}
+
+class SolverStats:
+    "Aggregated statistics of the `info` provided by `solve_sdp` over several solves."
+    def __init__(self):
+        self.solves, self.failures, self.timeouts, self.time, self.iterations = 0, 0, 0, 0., 0
+        self.coalesced = 0 # Solves avoided waiting for the same SDP solved by another process
+        self.predicted, self.measured = 0., 0. # Predicted and actual time of the solve phase, for calibration
+        self.phases, self.solvers = {}, {} # Total time of every phase and solves provided by every solver
+
+    def add(self, info):
+        "Adds the statistics of a solve."
+        self.solves += 1
+        self.failures += info['solver'] is None
+        self.timeouts += len(info.get('timed_out', []))
+        self.time += info['time']
+        self.iterations += info.get('iterations') or 0
+        for phase, elapsed in info.get('phases', {}).items(): self.phases[phase] = self.phases.get(phase, 0.) + elapsed
+        if info.get('preflight') is not None and 'solve' in info['phases']:
+            self.predicted += info['preflight']['time']
+            self.measured += info['phases']['solve']
+        if info['solver'] is not None: self.solvers[info['solver']] = self.solvers.get(info['solver'], 0) + 1
+
+    def summary(self):
+        "Statistics as a dictionary, including the mean time per solve."
+        return {'solves': self.solves, 'failures': self.failures, 'timeouts': self.timeouts, 'coalesced': self.coalesced,
+                'time': self.time, 'mean_time': self.time/max(self.solves, 1), 'iterations': self.iterations,
+                'phases': dict(self.phases), 'solvers': dict(self.solvers),
+                'preflight': {'predicted': self.predicted, 'measured': self.measured}}
+
+def compile_layout(layout, backend='picos', symmetries=(), N=None):
+    """Provides the template of the layout. It is only built the first time the (simplified) layout is seen with the
+    same `symmetries`, which may need the number of sites `N`."""
+    if backend not in TEMPLATES: raise ValueError(f"Unknown backend {backend}. Choose one from {list(TEMPLATES)}")
+    unsupported = set(symmetries) - set(TEMPLATES[backend].supported_symmetries)
+    if unsupported: raise ValueError(f"Backend {backend} does not support the symmetries {unsupported}")
+    layout = simplify_layout(layout)
+    symmetries = tuple(sorted(symmetries))
+    return _compile_layout(tuple(tuple(map(int, sites)) for sites in layout), backend, symmetries,
+                           N if symmetries else None)
+
+@lru_cache(maxsize=128)
+def _compile_layout(key, backend, symmetries, N):
+    return TEMPLATES[backend]([np.array(sites) for sites in key], symmetries=symmetries, N=N)
+
+@lru_cache(maxsize=16)
+def hamiltonian_terms(hamiltonian):
+    """Terms of the Hamiltonian as `(support, matrix, paulis, trace, lowest)` with the non-zero coefficients of their
+    Pauli strings, their normalized trace and their minimum eigenvalue. They are only found once per Hamiltonian."""
+    terms = []
+    for support, h in hamiltonian.to_sdp():
+        h = picos2np(h)
+        paulis = {ops: np.real(np.trace(pauli_matrix(ops) @ h))/len(h)
+                  for ops in itertools.product(range(4), repeat=len(support))}
+        paulis = {ops: coef for ops, coef in paulis.items() if not np.isclose(coef, 0)}
+        terms.append((tuple(map(int, support)), h, paulis, np.real(np.trace(h))/len(h), min(np.linalg.eigvalsh(h))))
+    return tuple(terms)
 
 def complementary_system(subsystem, size):
     "Obtains the complementary system of subsystem."
@@ -64,16 +195,524 @@ def picos2np(variable):
     "Converts picos variable (even sparse) to numpy matrix."
     return picos.expressions.data.cvx2np(variable.value)
 
+def compatibility_pairs(layout):
+    "Pairs of overlapping variables `(k1, k2)` whose compatibility implies the one of the rest of pairs."
+    sites = [set(map(int, s)) for s in layout]
+    candidates = [(k1, k2) for k1, k2 in itertools.combinations(range(len(sites)), 2) if sites[k1] & sites[k2]]
+    pairs = []
+    for k1, k2 in sorted(candidates, key=lambda pair: -len(sites[pair[0]] & sites[pair[1]])):
+        common, reached, frontier = sites[k1] & sites[k2], {k1}, [k1]
+        while frontier:
+            k = frontier.pop()
+            for pair in pairs:
+                if k in pair and common <= sites[pair[0]] & sites[pair[1]]:
+                    other = pair[1] if k == pair[0] else pair[0]
+                    if other not in reached: reached.add(other); frontier.append(other)
+        if k2 not in reached: pairs.append((k1, k2))
+    return pairs
+
+def normalization_roots(n, pairs):
+    "One variable of every connected component, as the compatibility of the rest fixes their trace."
+    component = list(range(n))
+    def find(k):
+        while component[k] != k: k = component[k]
+        return k
+    for k1, k2 in pairs: component[find(k2)] = find(k1)
+    return [k for k in range(n) if find(k) == k]
+
+@lru_cache(maxsize=None)
+def overlap(sites1, sites2):
+    """Common sites of two variables given as tuples of sorted sites, together with the positions of the rest of
+    sites in each of them, which are traced out to obtain their reduced density matrices over the common sites."""
+    common, idx1, idx2 = np.intersect1d(sites1, sites2, return_indices=True)
+    return tuple(map(int, common)), complementary_system(idx1, len(sites1)), complementary_system(idx2, len(sites2))
+
+@lru_cache(maxsize=None)
+def partial_trace_indices(size, kept):
+    "Partial trace over `size` sites keeping the positions `kept` as indices into the flattened matrices."
+    kept, rest, dk = list(kept), complementary_system(kept, size), 2**len(kept)
+    index = np.arange(4**size).reshape((2,)*2*size).transpose(kept + rest + [size+i for i in kept + rest])
+    index = index.reshape(dk, 2**len(rest), dk, 2**len(rest))
+    index = np.stack([index[:, j, :, j].ravel() for j in range(2**len(rest))])
+    index.setflags(write=False)
+    return index
+
+def partial_trace(matrix, kept):
+    "Reduced matrix of `matrix` over the sites at the positions `kept`."
+    size, dk = int(np.log2(len(matrix))), 2**len(kept)
+    return np.ravel(matrix)[partial_trace_indices(size, tuple(kept))].sum(axis=0).reshape(dk, dk)
+
+def embed_operator(operator, support, sites):
+    """Extends `operator` over the sites in `support`, taken in the order they appear in `sites`, to all the `sites`
+    with the identity."""
+    sites = list(map(int, sites))
+    positions = tuple(sorted(sites.index(int(site)) for site in support))
+    extended = np.zeros(4**len(sites), dtype=complex)
+    extended[partial_trace_indices(len(sites), positions)] = np.ravel(operator)
+    return extended.reshape(2**len(sites), 2**len(sites))
+
+def hermitian_dual(constraint, d):
+    "Multiplier of the equality `constraint` between `d`x`d` Hermitian matrices from its picos dual."
+    if constraint.dual is None: raise ValueError("The constraint has no dual solution")
+    dual = np.ravel(picos.expressions.data.cvx2np(constraint.dual), order='F')
+    dual = np.concatenate([dual.real, dual.imag]).reshape((2*d, d), order='F')
+    dual = dual[:d] + 1j*dual[d:]
+    return (dual + dual.conj().T)/2
+
 # Cell
-def ojimetro(L):
+class SDPTemplate:
+    "Structure of the SDP associated to a layout. Only the objective changes between Hamiltonians."
+    supported_symmetries = ()
+
+    def __init__(self, layout, symmetries=(), N=None):
+        self.layout = layout
+        self.problem = picos.Problem()
+        self.variables = [(site, picos.HermitianVariable('rho'+','.join(map(str, site)), (2**len(site), 2**len(site)))) for site in layout]
+        self.pairs = compatibility_pairs(layout) # Non-redundant compatibility constraints
+        self.problem.add_list_of_constraints([rho >> 0 for _, rho in self.variables])
+        self.problem.add_list_of_constraints([picos.trace(self.variables[k][1]) == 1
+                                              for k in normalization_roots(len(layout), self.pairs)])
+        self.compatibility = self._compatibility_constraints()
+        self.problem.add_list_of_constraints(self.compatibility)
+        self.containers = {} # Hamiltonian support -> first variable containing it
+
+    def solve(self, hamiltonian, warm_start=None, return_rdms=False, tol=None, max_iters=None, solver='cvxopt'):
+        "Solves the SDP for the given Hamiltonian with the picos `solver`, keeping the solve statistics in `info`."
+        timer, stats, error = PhaseTimer(), {}, None
+        with timer('objective'):
+            objective = self.objective(hamiltonian)
+            self.problem.set_objective('min', objective)
+        try:
+            with timer('solve'):
+                solution = self.problem.solve(solver=solver, abs_ipm_opt_tol=tol, rel_ipm_opt_tol=tol,
+                                              rel_prim_fsb_tol=tol, rel_dual_fsb_tol=tol, max_iterations=max_iters,
+                                              primals=None, duals=None)
+            with timer('extraction'):
+                energy, status = np.real(objective.value), solution.claimedStatus
+                stats = cvxopt_stats(solution.info.get('cvxopt_sol'))
+                result = self.dual_bound(hamiltonian)
+                rdms = self.rdms() if return_rdms else None
+        except (picos.SolutionFailure, ArithmeticError, ValueError) as failure:
+            energy, status, result, rdms, error = 0., 'failed', 0., {}, f"{type(failure).__name__}: {failure}"
+        self.info = {'energy': energy, 'bound': result, 'status': status, 'error': error, **stats,
+                     'variables': sum(rho.dim for _, rho in self.variables),
+                     'constraints': len(self.problem.constraints), 'phases': timer.phases}
+        if return_rdms: return result, rdms
+        return result
+
+    def rdms(self):
+        "Reduced density matrices of every variable at the current solution."
+        return {tuple(map(int, sites)): np.array(rho.value) for sites, rho in self.variables}
+
+    def objective(self, hamiltonian):
+        "Energy of the Hamiltonian in terms of the SDP variables."
+        operators, constant = self.local_operators(hamiltonian)
+        return sum((self.variables[k][1] | picos.Constant(operator)) for k, operator in operators.items()) + constant
+
+    def local_operators(self, hamiltonian):
+        """Splits the Hamiltonian into operators over the variables, assigning every term to the first variable that
+        contains it. The terms without any contribute with their minimum eigenvalue to the returned constant."""
+        operators, constant = {}, 0.
+        for support, h, _, _, lowest in hamiltonian_terms(hamiltonian):
+            k = self.container(support)
+            if k is None: constant += lowest
+            else:         operators[k] = operators.get(k, 0) + embed_operator(h, support, self.variables[k][0])
+        return operators, constant
+
+    def dual_bound(self, hamiltonian):
+        "Lower bound to the energy from the multipliers of the compatibility constraints."
+        local, bound = self.local_operators(hamiltonian)
+        operators = [local.get(k, np.zeros((2**len(sites),)*2)) for k, (sites, _) in enumerate(self.variables)]
+        for (k1, k2), constraint in zip(self.pairs, self.compatibility):
+            common, _, _ = overlap(*(tuple(map(int, self.variables[k][0])) for k in (k1, k2)))
+            dual = hermitian_dual(constraint, 2**len(common))
+            operators[k1] = operators[k1] - embed_operator(dual, common, self.variables[k1][0])
+            operators[k2] = operators[k2] + embed_operator(dual, common, self.variables[k2][0])
+        return bound + sum(np.linalg.eigvalsh(operator)[0] for operator in operators)
+
+    def container(self, support):
+        "Index of the first variable containing `support`. `None` if there is none."
+        key = tuple(map(int, support))
+        if key not in self.containers:
+            self.containers[key] = next((k for k, (sites, _) in enumerate(self.variables)
+                                         if set(key) <= set(map(int, sites))), None)
+        return self.containers[key]
+
+    def _compatibility_constraints(self):
+        "Reduced density matrices of overlapping variables must match."
+        compatibility_constraints = []
+        for k1, k2 in self.pairs:
+            (sites1, rho1), (sites2, rho2) = self.variables[k1], self.variables[k2]
+            _, traced1, traced2 = overlap(tuple(map(int, sites1)), tuple(map(int, sites2)))
+            partial_trace1 = rho1.partial_trace(traced1)
+            partial_trace2 = rho2.partial_trace(traced2)
+            compatibility_constraints.append(partial_trace1 - partial_trace2 == 0)
+        return compatibility_constraints
+
+# Cell
+PAULIS = [np.eye(2), np.array([[0, 1], [1, 0]]), np.array([[0, -1j], [1j, 0]]), np.array([[1, 0], [0, -1]])]
+
+class ConicTemplate:
+    "Structure of the SDP associated to a layout in the Pauli basis as sparse LMI data for `cvxopt.solvers.sdp`."
+    supported_symmetries = ('translation', 'real', 'parity')
+
+    def __init__(self, layout, symmetries=(), N=None):
+        self.layout = layout
+        self.N = N
+        self.translation = 'translation' in symmetries and translation_invariant(layout, N)
+        # Real and parity-preserving variables only need the Pauli strings with an even number of Y and X+Y
+        self.real, self.parity = 'real' in symmetries, 'parity' in symmetries
+        self.keys = {}  # Pauli string (or its representative under the symmetries) -> variable index
+        self.supports = [set(map(int, sites)) for sites in layout]
+        self.blocks = []
+        for sites in layout:
+            cols = [self.keys.setdefault(self.canonical(pauli_key(sites, ops)), len(self.keys))
+                    for ops in self.paulis(len(sites))]
+            self.blocks.append((sites, cols))
+        # With translation invariance, the positivity of a variable implies the one of all its translations
+        self.lmi_blocks = translation_representatives(self.blocks, N) if self.translation else self.blocks
+        self.groups = {} # Variable size -> Pauli coefficient indices of every variable with that size
+        for sites, cols in self.lmi_blocks: self.groups.setdefault(len(sites), []).append(cols)
+        self.groups = {size: np.array(cols) for size, cols in self.groups.items()}
+        self.counts = np.zeros(len(self.keys))
+        for cols in self.groups.values(): np.add.at(self.counts, cols, 1)
+        self.Gs, self.hs, self.lmis = [], [], [] # LMI -> (variable size, position in its group, sparse pattern)
+        positions = {size: 0 for size in self.groups}
+        for sites, cols in self.lmi_blocks:
+            size = len(sites)
+            for rows, vals, strings, m in lmi_coefficients(size, self.real, self.parity):
+                self.Gs.append(spmatrix(-vals, rows, np.array(cols)[strings], (m*m, len(self.keys))))
+                self.hs.append(matrix(np.eye(m)/2**size))
+                self.lmis.append((size, positions[size], rows, vals, strings))
+            positions[size] += 1
+
+    def solve(self, hamiltonian, warm_start=None, return_rdms=False, tol=None, max_iters=None, primalstart=None,
+              dualstart=None):
+        "Solves the SDP for the given Hamiltonian with cvxopt, keeping the solve statistics in `info`."
+        timer, stats, error = PhaseTimer(), {}, None
+        with timer('objective'): c, c0 = self.objective(hamiltonian)
+        with timer('warm start'):
+            if warm_start is not None and primalstart is None: primalstart = self.initial_point(warm_start)
+        options = {'show_progress': False}
+        if tol is not None: options.update(abstol=tol, reltol=tol, feastol=tol)
+        if max_iters is not None: options['maxiters'] = max_iters
+        try:
+            with timer('solve'):
+                solution = solvers.sdp(matrix(c), Gs=self.Gs, hs=self.hs, primalstart=primalstart, dualstart=dualstart,
+                                       options=options)
+            with timer('extraction'):
+                x, status, stats = np.array(solution['x']).ravel(), solution['status'], cvxopt_stats(solution)
+                result = self.dual_bound(solution['zs'], c) + c0
+                rdms = self.rdms(x) if return_rdms else None
+        except (ArithmeticError, ValueError) as failure:
+            x, status, result, error = np.zeros(len(self.keys)), 'failed', 0., f"{type(failure).__name__}: {failure}"
+            rdms = self.rdms(x) if return_rdms else None
+        self.info = {'energy': c @ x + c0, 'bound': result, 'status': status, 'error': error, **stats,
+                     'variables': len(self.keys), 'constraints': len(self.Gs), 'phases': timer.phases}
+        if return_rdms: return result, rdms
+        return result
+
+    def dual_bound(self, zs, c):
+        "Lower bound to `c·x` from the dual matrices `zs` of the LMIs."
+        if zs is None or zs[0] is None: raise ValueError("The solver provided no dual solution")
+        coefficients = {size: np.zeros(cols.shape) for size, cols in self.groups.items()}
+        for (size, position, rows, vals, strings), z in zip(self.lmis, zs):
+            z = np.array(z).ravel(order='F')
+            coefficients[size][position] += np.bincount(strings, weights=vals*z[rows], minlength=len(self.paulis(size)))
+        return self.lower_bound(coefficients, c)
+
+    def lower_bound(self, coefficients, c):
+        "Lower bound to `c·x` from a split of `c` into the Pauli `coefficients` of every variable."
+        mismatch = (c - self._consensus(coefficients)*self.counts)/self.counts
+        return sum(minimum_eigenvalues(coefficients[size] + mismatch[cols], size, self.real, self.parity).sum()
+                   for size, cols in self.groups.items())
+
+    def _consensus(self, y):
+        "Average value of every Pauli string among the variables containing it."
+        total = np.zeros(len(self.keys))
+        for size, cols in self.groups.items(): np.add.at(total, cols, y[size])
+        return total/self.counts
+
+    def paulis(self, size):
+        "Pauli strings over `size` sites allowed by the symmetries of the problem."
+        return local_paulis(size, self.real, self.parity)
+
+    def canonical(self, key):
+        "Representative of the Pauli string `key` under the symmetries of the problem."
+        if not self.translation or not key: return key
+        # The smallest translation starts at site 0, so it is enough to bring each site of the string there
+        return min(tuple(sorted(((site-shift) % self.N, op) for site, op in key)) for shift, _ in key)
+
+    def rdms(self, x):
+        "Reduced density matrices of every variable given the Pauli coefficients `x`."
+        rdms = {}
+        for sites, cols in self.blocks:
+            d = 2**len(sites)
+            rho = np.eye(d, dtype=complex)
+            for col, ops in zip(cols, self.paulis(len(sites))): rho += x[col]*pauli_matrix(ops)
+            rdms[tuple(map(int, sites))] = rho/d
+        return rdms
+
+    def initial_point(self, rdms, margin=0.1):
+        "Strictly feasible starting point from the reduced density matrices `rdms` of a neighbouring layout."
+        x = np.zeros(len(self.keys))
+        for key, col in self.keys.items():
+            value = expectation(rdms, key)
+            if value is None: value = np.prod([expectation(rdms, (pauli,)) or 0. for pauli in key])
+            x[col] = value
+        slacks = self.slacks(x)
+        alpha = 1.
+        for s, h in zip(slacks, self.hs):
+            d = 1/h[0, 0]
+            lambda_min = np.linalg.eigvalsh(s)[0]
+            if d*lambda_min < margin: alpha = min(alpha, (1-margin)/(1-d*lambda_min))
+        x = alpha*x
+        return {'x': matrix(x), 'ss': [matrix(s) for s in self.slacks(x)]}
+
+    def slacks(self, x):
+        "Linear matrix inequalities `h - Gx` evaluated at `x`."
+        x = matrix(x)
+        return [np.array(h - matrix(G*x, h.size)) for G, h in zip(self.Gs, self.hs)]
+
+    def objective(self, hamiltonian):
+        "Energy of the Hamiltonian as a linear function `c·x + c0` of the Pauli coefficients."
+        c, c0 = np.zeros(len(self.keys)), 0.
+        for support, _, paulis, trace, lowest in hamiltonian_terms(hamiltonian):
+            if any(set(support) <= sites for sites in self.supports):
+                for ops in self.paulis(len(support)):
+                    if ops in paulis: c[self.keys[self.canonical(pauli_key(support, ops))]] += paulis[ops]
+                c0 += trace
+            else:
+                c0 += lowest
+        return c, c0
+
+def translation_invariant(layout, N):
+    "Checks whether the layout is invariant under translations in a ring of `N` sites."
+    blocks = {frozenset(map(int, sites)) for sites in layout}
+    return N is not None and blocks == {frozenset((site+1) % N for site in block) for block in blocks}
+
+def translation_representatives(blocks, N):
+    "Keeps a single `(sites, cols)` block from every set of blocks related by translations."
+    representatives, seen = [], set()
+    for sites, cols in blocks:
+        if frozenset(map(int, sites)) not in seen:
+            representatives.append((sites, cols))
+            seen.update(frozenset((int(site)+shift) % N for site in sites) for shift in range(N))
+    return representatives
+
+def expectation(rdms, key):
+    "Expectation value of the Pauli string `key` from the first reduced density matrix containing its support."
+    paulis = dict(key)
+    for sites, rho in rdms.items():
+        if all(site in sites for site in paulis):
+            ops = tuple(paulis.get(site, 0) for site in sites)
+            return np.real(np.trace(rho @ pauli_matrix(ops)))
+    return None
+
+def pauli_key(sites, ops):
+    "Identifies the Pauli string `ops` acting on `sites` by its non-trivial `(site, operator)` pairs."
+    return tuple(sorted((int(site), op) for site, op in zip(sites, ops) if op))
+
+@lru_cache(maxsize=None)
+def local_paulis(size, real=False, parity=False):
+    "Non-trivial Pauli strings over `size` sites as operator indices, only the `real` or `parity` ones if given."
+    return [ops for ops in itertools.product(range(4), repeat=size) if any(ops)
+            and not (real and ops.count(2) % 2) and not (parity and (ops.count(1) + ops.count(2)) % 2)]
+
+@lru_cache(maxsize=None)
+def pauli_matrix(ops):
+    "Matrix of the Pauli string `ops`."
+    return reduce(np.kron, [PAULIS[op] for op in ops], np.ones((1, 1)))
+
+@lru_cache(maxsize=None)
+def lmi_coefficients(size, real=False, parity=False):
+    "Rows, values, Pauli string and dimension of every block of the real LMI of a variable with `size` sites."
+    d = 2**size
+    parities = np.array([bin(i).count('1') % 2 for i in range(d)])
+    sectors = [np.flatnonzero(parities == p) for p in (0, 1)] if parity and size else [np.arange(d)]
+    blocks = []
+    for sector in sectors:
+        rows, vals, strings = [], [], []
+        for k, ops in enumerate(local_paulis(size, real, parity)):
+            P = pauli_matrix(ops)[np.ix_(sector, sector)]/d
+            E = (P.real if real else np.block([[P.real, -P.imag], [P.imag, P.real]])).ravel()
+            idx = np.flatnonzero(E)
+            rows.append(idx); vals.append(E[idx]); strings.append(np.full(len(idx), k))
+        m = len(sector) if real else 2*len(sector)
+        blocks.append((np.concatenate(rows), np.concatenate(vals), np.concatenate(strings), m))
+    return blocks
+
+# Cell
+class ADMMTemplate(ConicTemplate):
+    "Decomposition of the SDP of a layout into its variables, which reach a consensus over their overlaps with ADMM."
+    def solve(self, hamiltonian, warm_start=None, return_rdms=False, tol=1e-6, max_iters=10000, rho=1., n_jobs=1):
+        "Solves the SDP for the given Hamiltonian with ADMM, keeping the solve statistics in `info`."
+        timer = PhaseTimer()
+        with timer('objective'): c, c0 = self.objective(hamiltonian)
+        with timer('warm start'):
+            x = np.zeros(len(self.keys))
+            if warm_start is not None: x = np.array(self.initial_point(warm_start)['x']).ravel()
+        # The objective is evenly shared among the variables containing each Pauli string
+        shares = {size: c[cols]/self.counts[cols] for size, cols in self.groups.items()}
+        u = {size: np.zeros(cols.shape) for size, cols in self.groups.items()}
+        threshold = tol*np.sqrt(self.counts.sum())
+        with timer('solve'), Parallel(n_jobs=n_jobs) as parallel:
+            for iteration in range(1, max_iters+1):
+                y = self._project({size: x[cols] - u[size] - shares[size]/rho for size, cols in self.groups.items()},
+                                  parallel, n_jobs)
+                x_old, x = x, self._consensus({size: y[size] + u[size] for size in y})
+                for size, cols in self.groups.items(): u[size] += y[size] - x[cols]
+                primal = np.sqrt(sum(np.sum((y[size] - x[cols])**2) for size, cols in self.groups.items()))
+                dual = rho*np.sqrt(np.sum(self.counts*(x - x_old)**2))
+                converged = primal < threshold and dual < threshold
+                if converged: break
+                if primal > 10*dual or dual > 10*primal:
+                    factor = 2. if primal > dual else 0.5
+                    rho, u = rho*factor, {size: values/factor for size, values in u.items()}
+        with timer('extraction'):
+            # The scaled multipliers split the objective among the variables
+            bound = self.lower_bound({size: shares[size] + rho*u[size] for size in u}, c) + c0
+            rdms = self.rdms(x) if return_rdms else None
+        self.info = {'energy': c @ x + c0, 'bound': bound, 'iterations': iteration, 'converged': converged,
+                     'status': 'optimal' if converged else 'unknown', 'primal_residual': primal, 'dual_residual': dual,
+                     'variables': len(self.keys), 'constraints': len(self.lmi_blocks), 'phases': timer.phases}
+        if return_rdms: return bound, rdms
+        return bound
+
+    def _project(self, z, parallel, n_jobs):
+        "Projects the Pauli coefficients of every variable, split in `n_jobs` chunks."
+        tasks = [(size, chunk) for size in z for chunk in np.array_split(np.arange(len(z[size])), n_jobs) if len(chunk)]
+        projections = parallel(delayed(project_rdms)(z[size][chunk], size, self.real, self.parity)
+                               for size, chunk in tasks)
+        y = {size: np.empty_like(values) for size, values in z.items()}
+        for (size, chunk), projection in zip(tasks, projections): y[size][chunk] = projection
+        return y
+
+def project_rdms(z, size, real=False, parity=False):
+    """Projects the Pauli coefficients `z`, with a row for each variable over `size` sites, onto the ones of positive
+    semidefinite matrices with unit trace in the Frobenius norm."""
+    P, d = pauli_basis(size, real, parity), 2**size
+    w, v = np.linalg.eigh((np.eye(d) + np.einsum('bp,pij->bij', z, P))/d)
+    rho = (v*simplex_projection(w)[:, None, :]) @ v.conj().transpose(0, 2, 1)
+    return np.einsum('pij,bji->bp', P, rho).real
+
+def simplex_projection(w):
+    "Euclidean projection of every row of `w` onto the probability simplex."
+    u = -np.sort(-w, axis=1)
+    cumsum = np.cumsum(u, axis=1) - 1
+    support = np.count_nonzero(u - cumsum/np.arange(1, w.shape[1]+1) > 0, axis=1)
+    theta = cumsum[np.arange(len(w)), support-1]/support
+    return np.maximum(w - theta[:, None], 0)
+
+def minimum_eigenvalues(coefficients, size, real=False, parity=False):
+    "Minimum eigenvalue of the operators over `size` sites with the Pauli `coefficients` given in every row."
+    return np.linalg.eigvalsh(np.einsum('bp,pij->bij', coefficients, pauli_basis(size, real, parity)))[:, 0]
+
+@lru_cache(maxsize=None)
+def pauli_basis(size, real=False, parity=False):
+    "Matrices of the Pauli strings over `size` sites allowed by the symmetries, stacked along the first axis."
+    return np.array([pauli_matrix(ops) for ops in local_paulis(size, real, parity)], dtype=complex)
+
+TEMPLATES = {'picos': SDPTemplate, 'native': ConicTemplate, 'admm': ADMMTemplate}
+
+# Cell
+SOLVERS = {'picos': ('picos', {}), 'native': ('native', {}), 'admm': ('admm', {})} # Name -> (backend, options)
+SOLVERS.update({f'picos-{solver}': ('picos', {'solver': solver}) for solver in picos.available_solvers()
+                if solver != 'cvxopt'})
+# Fallback chains of solvers for layouts with, at most, the given amount of free parameters
+ROUTES = [(1500, ['native', 'admm', 'picos']), (np.inf, ['admm', 'native'])]
+
+def register_solver(name, backend, **options):
+    "Registers the `backend` solved with the given `options` of its `solve` as the solver `name`."
+    if backend not in TEMPLATES: raise ValueError(f"Unknown backend {backend}. Choose one from {list(TEMPLATES)}")
+    SOLVERS[name] = (backend, options)
+
+def route_layout(layout, symmetries=(), routes=None):
+    "Chain of solvers for the layout from the `routes` (`ROUTES` by default) given its free parameters."
+    params = ojimetro(layout, symmetries)
+    return next(chain for limit, chain in (ROUTES if routes is None else routes) if params <= limit)
+
+# Cell
+# Backend -> (overhead, slope) of the affine models of the peak memory (bytes) and solve time (s) given `cost_model`,
+# fit with `calibrate_preflight` on a single core
+PREFLIGHT = {'native': {'memory': (9.3e6, 0.46), 'time': (0.02, 2.6e-9)},
+             'admm':   {'memory': (5.6e6, 1.34), 'time': (0.016, 1.9e-6)},
+             'picos':  {'memory': (8.7e6, 2.93), 'time': (0.054, 1.2e-8)}}
+# Rings (sites, variable size) solved by `calibrate_preflight` for every backend
+BENCHMARKS = {'native': [(8, 2), (10, 3), (10, 4), (12, 4)], 'admm': [(8, 2), (10, 3), (10, 4), (12, 4)],
+              'picos': [(8, 2), (8, 3), (10, 3)]}
+
+def cost_model(layout, backend='native', symmetries=()):
+    "Memory (bytes) and floating point operations of the dense linear algebra of a solve of the layout."
+    layout = simplify_layout(layout)
+    sizes = [len(sites) for sites in layout]
+    if backend == 'admm':
+        memory = 16.*sum(16**k for k in set(sizes)) + 16.*sum(4**k for k in sizes)
+        return memory, float(sum(8**k + 16**k for k in sizes))
+    if backend == 'picos': symmetries = () # Complex variables without any reduction
+    real, parity, n = 'real' in symmetries, 'parity' in symmetries, float(ojimetro(layout, symmetries))
+    sides = []
+    for k in sizes:
+        split = parity and k > 0
+        sides += [2**(k-split)*(1 if real else 2)]*(2 if split else 1)
+    sides = np.array(sides, dtype=float)
+    return 8*(n**2 + 2*n*np.sum(sides**2)), n*np.sum(sides**3) + n**2*np.sum(sides**2) + n**3/3
+
+def preflight(layout, solver='native', symmetries=()):
+    "Predicted peak memory (bytes) and solve time (s) of `solver` for the layout, without building the problem."
+    backend = SOLVERS[solver][0]
+    model = dict(zip(('memory', 'time'), cost_model(layout, backend, symmetries)))
+    return {key: overhead + slope*model[key] for key, (overhead, slope) in PREFLIGHT[backend].items()}
+
+def calibrate_preflight(backends=('native', 'admm', 'picos'), benchmarks=None):
+    """Fits `PREFLIGHT` to the local machine by solving the rings in `benchmarks` (`BENCHMARKS` by default) for XX
+    Hamiltonians. Every solve runs in a separate process to measure its peak memory."""
+    benchmarks = BENCHMARKS if benchmarks is None else benchmarks
+    for backend in backends:
+        models, measures = [], []
+        for N, size in benchmarks[backend]:
+            hamiltonian = XXHamiltonian(N, np.linspace(0.5, 1.5, N), np.ones(N)) # Without translation invariance
+            layout = [np.array([(i+j) % N for j in range(size)]) for i in range(N)]
+            models.append(cost_model(layout, backend, resolve_symmetries(hamiltonian, backend)))
+            with ProcessPoolExecutor(1, mp_context=get_context('fork')) as executor:
+                measures.append(executor.submit(_measure_solve, layout, hamiltonian, backend).result())
+        PREFLIGHT[backend] = {key: _fit_affine([model[k] for model in models], [measure[k] for measure in measures])
+                              for k, key in enumerate(('memory', 'time'))}
+    return PREFLIGHT
+
+def _measure_solve(layout, hamiltonian, backend):
+    "Increase of the peak memory (bytes) and time (s) of the solve phase of a solve in the current process."
+    start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    _, info = solve_sdp(layout, hamiltonian, backend=backend, return_info=True)
+    return 1024.*(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start), info['phases']['solve']
+
+def _fit_affine(x, y):
+    "Non-negative overhead and slope of `y = overhead + slope*x` fit by least relative squares."
+    x, y = np.array(x), np.array(y)
+    (overhead, slope), *_ = np.linalg.lstsq(np.stack([1/y, x/y], axis=1), np.ones(len(y)), rcond=None)
+    return float(max(overhead, 0.)), float(max(slope, 0.))
+
+# Cell
+def ojimetro(L, symmetries=()):
     "Estimates the amount of free parameters in the SDP associated to the layout."
-    # The old blocks are len(L)
-    L = simplify_layout(L)
-    all_variables = np.sum([2**(2*len(sites)) for sites in L])
-    intersections = []
-    for k, sites1 in enumerate(L[:-1]):
-        for sites2 in L[k+1:]:
-            intersections.append(np.intersect1d(sites1, sites2))
-    intersections = simplify_layout(intersections)
-    dep_variables = np.sum([2**(2*len(sites)) for sites in intersections])
-    return all_variables-dep_variables
\ No newline at end of file
+    return key_parameters(layout_key(L), symmetries)
+
+def key_parameters(key, symmetries=()):
+    "Free parameters estimated by `ojimetro` for the layout with the given `layout_key`."
+    return _ojimetro(key, tuple(sorted(set(symmetries))))
+
+@lru_cache(maxsize=2**16)
+def _ojimetro(key, symmetries):
+    masks = np.array(key, dtype=np.int64 if max(key, default=0) < 2**63 else object)
+    intersections = simplify_masks((masks[:, None] & masks[None, :])[np.triu_indices(len(masks), 1)])
+    all_variables = sum(free_parameters(bin(mask).count('1'), symmetries) for mask in key)
+    dep_variables = sum(free_parameters(bin(mask).count('1'), symmetries) for mask in intersections)
+    return all_variables-dep_variables
+
+def free_parameters(size, symmetries=()):
+    "Real parameters of a reduced density matrix over `size` sites, trace included, given the `symmetries`."
+    d, empty = 2**size, int(size == 0)
+    if 'real' in symmetries and 'parity' in symmetries: return (d*d + 2*d + empty)//4
+    if 'real' in symmetries:                            return (d*d + d)//2
+    if 'parity' in symmetries:                          return (d*d + empty)//2
+    return d*d
\ No newline at end of file
@@ -1,7 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/04_training.ipynb (unless otherwise specified).
 
-__all__ = ['DQNTrainer', 'train_agent', 'step', 'get_reward', 'evaluate_agent', 'check_optim', 'explore_brfs',
-           'BrFSTrainer', 'explore_mc', 'MCTrainer']
+__all__ = ['DQNTrainer', 'train_agent', 'step', 'submit_step', 'vec_step', 'get_reward', 'evaluate_agent',
+           'check_optim', 'explore_brfs', 'BrFSTrainer', 'explore_mc', 'MCTrainer']
 
 # Cell
 import numpy as np
@@ -13,6 +13,7 @@ from joblib import Parallel, delayed
 
 from bounce.agents import DQNAgent, DQN, BrFSAgent, MCAgent
 from bounce.environment import SDPEnvironment
+from bounce.sdp import SolverStats
 from bounce.utils import T, state_in_list, state2str
 from bounce.utils import load_checkpoint, save_model, load_model
 
@@ -25,8 +26,8 @@ class DQNTrainer:
     "Trainer for DQN agents"
     @delegates(DQNAgent.__init__)
     def __init__(self, N, H, budget_profile, reward_fun="energy_norm",
-                 n_agents=1, models=None, arch=DQN, n_jobs=1, **kwargs):
-        self.env = SDPEnvironment(N, H, budget_profile, reward_criterion=reward_fun)
+                 n_agents=1, models=None, arch=DQN, n_jobs=1, store='shared', **kwargs):
+        self.env = SDPEnvironment(N, H, budget_profile, reward_criterion=reward_fun, store=store)
         self.arch = arch
         self.agent_kwargs = kwargs
         self.n_agents = n_agents
@@ -46,7 +47,7 @@ class DQNTrainer:
         "Changes the environment parameters"
         if H is None: H = self.env.H
         if budget_profile is None: budget_profile = self.env.param_profile
-        self.env = SDPEnvironment(self.env.N, H, budget_profile, reward_criterion="energy_norm")
+        self.env = SDPEnvironment(self.env.N, H, budget_profile, reward_criterion="energy_norm", store=self.env.store)
         if self.envs is not None:
             self.envs = [deepcopy(self.env) for _ in range(len(self.envs))]
 
@@ -112,12 +113,14 @@ def train_agent(env, agent, episodes, time_steps=20, opt=None, best_ref=None,
     if isinstance(episodes, int): episodes = (episodes,)
     final_reward, final_params, final_energies, final_optimals, optimal_states = [], [], [], [], []
     visited_states, visited_energies, visited_params, oracle_rewards, visited_rewards = [], [], [], [], []
+    solver_stats = [] # Solver statistics of every episode
     ckp_dir = Path("../trained_models/checkpoints/"); ckp_dir.mkdir(parents=True, exist_ok=True)
     ckp_name = None
     breaking = False
 
     for e in tqdm(range(*episodes)):
         state = deepcopy(env.reset())  # Reset environment at the beginning of each game
+        env.episode_stats = SolverStats()
         optims = []
         for _ in range(time_steps):
             next_state, action, energy, params, err = step(state, agent, env, e) # perform step
@@ -148,6 +151,7 @@ def train_agent(env, agent, episodes, time_steps=20, opt=None, best_ref=None,
 
         final_params.append(params)
         final_energies.append(energy)
+        solver_stats.append(env.episode_stats.summary())
         if opt is not None:
             final_optimals.append(check_optim(opt, energy, params))
             optimal_states.append(np.mean(optims))
@@ -160,7 +164,7 @@ def train_agent(env, agent, episodes, time_steps=20, opt=None, best_ref=None,
                    'final_reward': final_reward, 'final_params': final_params, 'final_energies': final_energies,
                    'eval_optims': final_optimals, 'expl_optims': optimal_states, 'visited_states': visited_states,
                    'visited_energies': visited_energies, 'visited_params': visited_params,
-                   'oracle_rewards': oracle_rewards, 'visited_rewards': visited_rewards}
+                   'oracle_rewards': oracle_rewards, 'visited_rewards': visited_rewards, 'solver_stats': solver_stats}
             torch.save(checkpoint, ckp_dir/ckp_name)
             env.save_memory()
 
@@ -176,10 +180,20 @@ DQNTrainer.train = delegates(to=train_agent)(DQNTrainer.train)
 # Cell
 def step(state, agent, environment, episode=1):
     "Take a step forward from state following the agent's policy"
-    actions = agent.try_actions(state)
-    next_state, action, energy, params, err = environment.perform_action(actions, episode)
+    next_state, action, energy, params, err = submit_step(state, agent, environment, episode).result()
     return next_state, action, energy, params, err
 
+def submit_step(state, agent, environment, episode=1):
+    """Asynchronous `step`, returning a future with its outcome. The agent can keep working while the environment
+    solves the SDPs with its `executor`."""
+    return environment.submit_action(agent.try_actions(state), episode)
+
+def vec_step(states, agent, vec_environment, episode=1):
+    "Take a step forward from every state of a `VecSDPEnvironment` following the agent's policy"
+    actions = agent.try_actions_batch(states, vec_environment.action_masks(states))
+    next_states, actions, energies, params, errs = vec_environment.perform_actions(actions, episode)
+    return next_states, actions, energies, params, errs
+
 def get_reward(environment, energy, params, best_ref=None):
     "Returns the reward according to the environment"
     return environment.reward_fun(T([energy]), T([params]), best_ref=best_ref).item()
@@ -236,8 +250,8 @@ def explore_brfs(env, agent, max_states, opt=None, best_ref=None, break_opt=Fals
     return agent, env, visited_states, energies, parameters, rewards, optims
 
 class BrFSTrainer:
-    def __init__(self, N, H, budget_profile, reward_fun="energy_norm", n_agents=1, n_jobs=1):
-        self.env = SDPEnvironment(N, H, budget_profile, reward_criterion=reward_fun)
+    def __init__(self, N, H, budget_profile, reward_fun="energy_norm", n_agents=1, n_jobs=1, store='shared'):
+        self.env = SDPEnvironment(N, H, budget_profile, reward_criterion=reward_fun, store=store)
         self.n_agents = n_agents
         self.parallel = Parallel(n_jobs=n_jobs)
         self.reset()
@@ -311,8 +325,9 @@ def explore_mc(env, agent, max_states, opt=None, best_ref=None, ckp=20, break_op
 
 class MCTrainer:
     @delegates(MCAgent.__init__)
-    def __init__(self, N, H, budget_profile, reward_fun="energy_norm", n_agents=1, n_jobs=1, **kwargs):
-        self.env = SDPEnvironment(N, H, budget_profile, reward_criterion=reward_fun)
+    def __init__(self, N, H, budget_profile, reward_fun="energy_norm", n_agents=1, n_jobs=1, store='shared',
+                 **kwargs):
+        self.env = SDPEnvironment(N, H, budget_profile, reward_criterion=reward_fun, store=store)
         self.n_agents = n_agents
         self.parallel = Parallel(n_jobs=n_jobs)
         self.agent_kwargs = kwargs
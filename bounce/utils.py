@@ -2,8 +2,9 @@
 
 __all__ = ['plot_trainings', 'arrange_shape', 'best_so_far', 'convergence_time', 'indiv_convergence_time',
            'get_indiv_times', 'CPU_Unpickler', 'save_benchmark', 'load_benchmark', 'load_checkpoint',
-           'checkpoint2results', 'save_model', 'load_model', 'simplify_layout', 'fill_layout', 'state2int', 'state2str',
-           'state_in_list', 'T', 'flip', 'contained_constraints', 'action_mask', 'dist_exp', 'dist_poly', 'binomial']
+           'checkpoint2results', 'save_model', 'load_model', 'simplify_layout', 'layout_key', 'simplify_masks',
+           'fill_layout', 'state2int', 'state2str', 'state_in_list', 'T', 'flip', 'contained_constraints',
+           'action_mask', 'dist_exp', 'dist_poly', 'binomial']
 
 # Cell
 import numpy as np
@@ -193,6 +194,17 @@ def simplify_layout(L):
                 elif overlap == len(sites2): to_simplify.append(k1+1+k2)
     return [sites for k, sites in enumerate(L) if k not in to_simplify]
 
+def layout_key(L):
+    """Canonical key of a layout as the sorted bitmasks of the sites of its constraints, once simplified. Layouts
+    with the same constraints share it regardless of their order, repetitions or contained constraints."""
+    return simplify_masks([sum(1 << site for site in set(map(int, sites))) for sites in L])
+
+def simplify_masks(masks):
+    "Simplifies a layout of site bitmasks, providing the sorted tuple of the distinct ones not contained in another."
+    masks = np.unique(np.array(masks, dtype=np.int64 if max(masks, default=0) < 2**63 else object))
+    contained = (masks[:, None] & masks[None, :]) == masks[:, None]
+    return tuple(int(mask) for mask in masks[contained.sum(1) == 1])
+
 def fill_layout(L, N):
     "Fills layout with single-body terms that are missing."
     for n in range(N):